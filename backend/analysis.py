@@ -0,0 +1,234 @@
+import multiprocessing
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pydub.utils import get_encoder_name
+
+# Beats are analysed as mono at this rate, plenty for tempo and spectral shape
+SAMPLE_RATE = 22050
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+# Frames are transformed this many at a time to keep memory bounded on long recordings
+FRAMES_PER_BLOCK = 512
+MIN_BPM = 60
+MAX_BPM = 200
+ROLLOFF_PERCENT = 0.85
+# Log-normal tempo prior (centre BPM, width in octaves) to avoid half/double tempo picks
+PRIOR_BPM = 120
+PRIOR_OCTAVES = 1.0
+# Only this much of a recording is kept for analysis, the rest is only measured
+MAX_ANALYSIS_SECONDS = 600
+# ffmpeg is killed if decoding a file takes longer than this
+DECODE_TIMEOUT_SECONDS = 300
+READ_SIZE = 1 << 16
+# Only the end of ffmpeg's log is kept for the error message
+MAX_ERROR_CHARS = 1000
+
+def decode(path, max_seconds=MAX_ANALYSIS_SECONDS, timeout=DECODE_TIMEOUT_SECONDS):
+    """Stream any ffmpeg readable file as mono float32 PCM in [-1, 1].
+
+    Returns (samples, duration in seconds). ffmpeg does the downmixing and
+    resampling, so the PCM is held in memory once and never beyond max_seconds.
+    """
+    limit = int(max_seconds * SAMPLE_RATE) * 4
+    pcm = bytearray()
+    total = 0
+    # ffmpeg logs to a file rather than a pipe: a damaged file can log a line
+    # per frame, which would fill the pipe and block ffmpeg while we read stdout
+    with tempfile.TemporaryFile() as log:
+        process = subprocess.Popen([
+            get_encoder_name(), '-nostdin', '-loglevel', 'error',
+            '-i', path,
+            '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 'f32le', '-'
+        ], stdout=subprocess.PIPE, stderr=log)
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            with process:
+                while True:
+                    chunk = process.stdout.read(READ_SIZE)
+                    if not chunk:
+                        break
+                    if len(pcm) < limit:
+                        pcm += chunk[:limit - len(pcm)]
+                    total += len(chunk)
+        finally:
+            watchdog.cancel()
+        if timed_out.is_set():
+            raise RuntimeError(f"ffmpeg took longer than {timeout}s to decode {path}")
+        if process.returncode != 0:
+            log.seek(0)
+            error = log.read().decode(errors='replace').strip()[-MAX_ERROR_CHARS:]
+            raise RuntimeError(f"ffmpeg could not decode {path}: {error or f'exit code {process.returncode}'}")
+    return np.frombuffer(pcm, dtype=np.float32), total / 4 / SAMPLE_RATE
+
+def _estimate_bpm(onset_envelope, frame_rate):
+    """Tempo from the autocorrelation peak of the onset envelope, or None for silence"""
+    envelope = onset_envelope - onset_envelope.mean()
+    if not envelope.any():
+        return None
+    n = len(envelope)
+    spectrum = np.fft.rfft(envelope, 2 * n)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+
+    min_lag = int(np.floor(60 * frame_rate / MAX_BPM))
+    max_lag = min(int(np.ceil(60 * frame_rate / MIN_BPM)), n - 1)
+    if min_lag < 1 or max_lag <= min_lag:
+        return None
+    lags = np.arange(min_lag, max_lag + 1)
+    tempos = 60 * frame_rate / lags
+    prior = np.exp(-0.5 * (np.log2(tempos / PRIOR_BPM) / PRIOR_OCTAVES) ** 2)
+    weighted = autocorrelation[min_lag:max_lag + 1] * prior
+    peak = int(np.argmax(weighted))
+    lag = float(lags[peak])
+    # Lags are whole frames (~23ms), fit a parabola through the peak and its
+    # neighbours to find the fractional lag, otherwise 120 BPM reads as 117.5
+    if 0 < peak < len(weighted) - 1:
+        left, centre, right = weighted[peak - 1:peak + 2]
+        curvature = left - 2 * centre + right
+        if curvature < 0:
+            lag += 0.5 * (left - right) / curvature
+    return float(60 * frame_rate / lag)
+
+def extract_features(samples, sample_rate=SAMPLE_RATE, duration=None):
+    """Compute duration, tempo, loudness and spectral features from mono PCM.
+
+    Pass duration when samples only hold the start of a longer recording.
+    """
+    if duration is None:
+        duration = len(samples) / sample_rate
+    if len(samples) < FRAME_SIZE:
+        samples = np.pad(samples, (0, FRAME_SIZE - len(samples)))
+
+    rms_total = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64))))
+    frames = sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    window = np.hanning(FRAME_SIZE).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME_SIZE, 1 / sample_rate)
+
+    rms, centroid, rolloff, flux = [], [], [], []
+    previous = None
+    for start in range(0, len(frames), FRAMES_PER_BLOCK):
+        block = frames[start:start + FRAMES_PER_BLOCK]
+        rms.append(np.sqrt(np.mean(np.square(block), axis=1)))
+
+        magnitude = np.abs(np.fft.rfft(block * window, axis=1))
+        total = magnitude.sum(axis=1)
+        safe_total = np.where(total > 0, total, 1)
+        centroid.append((magnitude @ freqs) / safe_total)
+        cumulative = np.cumsum(magnitude, axis=1)
+        rolloff.append(freqs[np.argmax(cumulative >= ROLLOFF_PERCENT * total[:, None], axis=1)])
+
+        # Spectral flux against the previous frame, carried across blocks
+        log_magnitude = np.log1p(magnitude)
+        if previous is None:
+            previous = log_magnitude[:1]
+        shifted = np.vstack([previous, log_magnitude[:-1]])
+        flux.append(np.maximum(log_magnitude - shifted, 0).sum(axis=1))
+        previous = log_magnitude[-1:]
+
+    rms = np.concatenate(rms)
+    bpm = _estimate_bpm(np.concatenate(flux), sample_rate / HOP_SIZE)
+    return {
+        "duration": round(duration, 3),
+        "bpm": round(bpm, 1) if bpm else None,
+        "loudness": round(float(20 * np.log10(rms_total)), 2) if rms_total > 0 else None,
+        "energy": round(float(rms.mean()), 5),
+        "spectral_centroid": round(float(np.concatenate(centroid).mean()), 1),
+        "spectral_rolloff": round(float(np.concatenate(rolloff).mean()), 1)
+    }
+
+def analyze_file(path):
+    samples, duration = decode(path)
+    return extract_features(samples, duration=duration)
+
+def _lost(future):
+    """True if future did not (and will not) finish on its own pool"""
+    if not future.done():
+        return True
+    return future.cancelled() or isinstance(future.exception(), BrokenProcessPool)
+
+class AudioAnalyzer:
+    """Runs analyze_file in a process pool so decoding and FFTs stay off request threads"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Created lazily so each gunicorn worker gets its own pool after fork
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # Not fork, see PasswordHasher._get_pool
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('forkserver')
+                    )
+        return self._pool
+
+    def _reset_pool(self, broken):
+        # Only drop the pool that failed, another thread may already have replaced it
+        with self._lock:
+            if self._pool is broken:
+                self._pool = None
+        broken.shutdown(wait=False)
+
+    def _submit(self, path):
+        """Queue path on the current pool, returning (pool, future)"""
+        pool = self._get_pool()
+        try:
+            return pool, pool.submit(analyze_file, path)
+        except BrokenProcessPool:
+            # A child died (e.g. killed for memory), start a fresh pool and retry once
+            self._reset_pool(pool)
+            pool = self._get_pool()
+            return pool, pool.submit(analyze_file, path)
+
+    def submit(self, path, callback):
+        """Analyse path in the background, callback receives the finished future"""
+        _, future = self._submit(path)
+        future.add_done_callback(callback)
+        return future
+
+    def map(self, paths):
+        """Analyse many files, yielding (path, features or exception) in order.
+
+        When a child dies every file still queued on its pool fails with
+        BrokenProcessPool. Those are resubmitted to a fresh pool, so one bad
+        file does not fail the rest of the batch.
+        """
+        paths = list(paths)
+        futures = [self._submit(path) for path in paths]
+        retried = set()
+        for i, path in enumerate(paths):
+            while True:
+                pool, future = futures[i]
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    self._reset_pool(pool)
+                    # A file that already broke a fresh pool is probably what
+                    # kills the children, give up on it but not on the others
+                    give_up = i in retried
+                    retried.add(i)
+                    for j in range(i + 1 if give_up else i, len(paths)):
+                        if futures[j][0] is pool and _lost(futures[j][1]):
+                            futures[j] = self._submit(paths[j])
+                    if not give_up:
+                        continue
+                    result = e
+                except Exception as e:
+                    result = e
+                break
+            yield path, result
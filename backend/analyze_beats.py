@@ -0,0 +1,94 @@
+"""Backfill audio features for beats that have not been analysed yet.
+
+    python analyze_beats.py [--all] [--batch-size 32] [--workers 4]
+
+Each batch is downloaded in parallel threads, analysed in a process pool and
+written back with a single executemany update.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import requests
+from app import app, db, Beat, AUDIO_FEATURES
+from analysis import AudioAnalyzer
+
+def fetch(audio_url, directory):
+    """Return a local path for a beat's audio, downloading it if needed"""
+    if audio_url.startswith('/uploads/'):
+        return os.path.join(app.config['UPLOAD_FOLDER'], audio_url[len('/uploads/'):])
+    path = os.path.join(directory, os.path.basename(audio_url.split('?')[0]) or 'audio')
+    with requests.get(audio_url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(response.raw, f)
+    return path
+
+def _safe_fetch(beat, directory):
+    try:
+        # One directory per beat so two beats with the same file name don't collide
+        beat_directory = os.path.join(directory, str(beat.id))
+        os.makedirs(beat_directory)
+        return fetch(beat.audio_url, beat_directory)
+    except Exception as e:
+        print(f"Error downloading beat {beat.id}: {e}")
+        return None
+
+def analyze_batch(beats, analyzer, downloads):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = {}
+        for beat, path in zip(beats, downloads.map(lambda b: _safe_fetch(b, directory), beats)):
+            if path:
+                paths[path] = beat.id
+
+        rows = []
+        analyzed_at = datetime.utcnow()
+        for path, features in analyzer.map(list(paths)):
+            if isinstance(features, Exception):
+                print(f"Error analysing beat {paths[path]}: {features}")
+                continue
+            row = {f"b_{name}": features.get(name) for name in AUDIO_FEATURES}
+            row.update(b_id=paths[path], b_analyzed_at=analyzed_at)
+            rows.append(row)
+
+        if rows:
+            table = Beat.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.id == db.bindparam('b_id'))
+                .values(analyzed_at=db.bindparam('b_analyzed_at'),
+                        **{name: db.bindparam(f"b_{name}") for name in AUDIO_FEATURES}),
+                rows
+            )
+            db.session.commit()
+        return len(rows)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backfill audio features for beats")
+    parser.add_argument('--all', action='store_true', help="Re-analyse beats that already have features")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    analyzer = AudioAnalyzer(workers=args.workers)
+    with app.app_context(), ThreadPoolExecutor(max_workers=8) as downloads:
+        query = Beat.query.order_by(Beat.id)
+        if not args.all:
+            query = query.filter(Beat.analyzed_at.is_(None))
+
+        # Keyset pagination, so analysed beats dropping out of the filter can't skip rows
+        last_id, total = 0, 0
+        while True:
+            beats = query.filter(Beat.id > last_id).limit(args.batch_size).all()
+            if not beats:
+                break
+            last_id = beats[-1].id
+            total += analyze_batch(beats, analyzer, downloads)
+            print(f"Analysed {total} beats")
+
+        print("Audio feature backfill complete!")
@@ -4,12 +4,15 @@ from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, creat
 from flask_cors import CORS, cross_origin
 from flask_migrate import Migrate
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import os
 import mimetypes
 from dotenv import load_dotenv
 from google.oauth2 import id_token
 from google.auth.transport import requests
-from werkzeug.security import generate_password_hash, check_password_hash
+from hashing import PasswordHasher, HashingBusy
+from analysis import AudioAnalyzer
+from resumable import remove_session_files
 
 load_dotenv()
 
@@ -23,9 +26,20 @@ if not os.path.exists(UPLOAD_FOLDER):
 # Ensure proper MIME types are registered
 mimetypes.add_type('audio/wav', '.wav')
 mimetypes.add_type('audio/webm', '.webm')
+mimetypes.add_type('application/vnd.apple.mpegurl', '.m3u8')
+mimetypes.add_type('video/mp2t', '.ts')
+
+# Chunks of resumable uploads, kept outside UPLOAD_FOLDER so serve_audio never exposes them
+UPLOAD_SESSION_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'upload_sessions')
+if not os.path.exists(UPLOAD_SESSION_FOLDER):
+    os.makedirs(UPLOAD_SESSION_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max request size (single upload or one chunk)
+app.config['UPLOAD_SESSION_FOLDER'] = UPLOAD_SESSION_FOLDER
+app.config['MAX_UPLOAD_SIZE'] = int(os.getenv('MAX_UPLOAD_SIZE', 200 * 1024 * 1024))  # 200MB max resumable upload
+app.config['UPLOAD_CHUNK_SIZE'] = 4 * 1024 * 1024  # Suggested chunk size for resumable uploads
+app.config['UPLOAD_SESSION_TTL'] = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # Seconds before an unfinished upload is swept
 
 # Configure CORS
 
@@ -49,6 +63,34 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-key-change-in-pr
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=1)
 app.config['ADMIN_SECRET'] = os.getenv('ADMIN_SECRET', 'your-admin-secret')  # Add this to your Render env variables
 
+app.config['WEB_THREADS'] = int(os.getenv('WEB_THREADS', 8))  # Request threads per gunicorn worker, passed to --threads in the Procfile
+
+# Password hashing, stored hashes using other parameters are upgraded on login
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')  # or e.g. pbkdf2:sha256:600000
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # Processes per gunicorn worker
+# Hashes allowed to wait for a process. By default hashing may hold at most half
+# of a worker's request threads, the rest stay free for other endpoints.
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.getenv(
+    'PASSWORD_HASH_QUEUE_SIZE', max(0, app.config['WEB_THREADS'] // 2 - app.config['PASSWORD_HASH_WORKERS'])
+))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0))  # Seconds to wait for a queue slot
+app.config['PASSWORD_HASH_NICENESS'] = int(os.getenv('PASSWORD_HASH_NICENESS', 10))  # CPU priority drop for hashing processes
+
+# Trending feed ranking
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))  # Engagement loses half its weight every N hours
+app.config['TRENDING_RESCALE_AFTER_DAYS'] = float(os.getenv('TRENDING_RESCALE_AFTER_DAYS', 7))  # Rescale stored scores once the epoch is this old
+
+# Post-upload processing (HLS packaging), runs after the upload request has returned
+app.config['BACKGROUND_WORKERS'] = int(os.getenv('BACKGROUND_WORKERS', 2))  # Threads per gunicorn worker
+
+# Audio feature extraction
+app.config['ANALYSIS_WORKERS'] = int(os.getenv('ANALYSIS_WORKERS', 1))  # Processes per gunicorn worker
+
+# Hashing requests past this limit get a 503, it has to be below the thread
+# count or a login storm can still occupy every request thread
+if app.config['PASSWORD_HASH_WORKERS'] + app.config['PASSWORD_HASH_QUEUE_SIZE'] >= app.config['WEB_THREADS']:
+    raise ValueError("PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE must be less than WEB_THREADS")
+
 # Enable SQLAlchemy logging
 # import logging
 # logging.basicConfig()
@@ -58,6 +100,15 @@ app.config['ADMIN_SECRET'] = os.getenv('ADMIN_SECRET', 'your-admin-secret')  # A
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    queue_size=app.config['PASSWORD_HASH_QUEUE_SIZE'],
+    queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+    niceness=app.config['PASSWORD_HASH_NICENESS']
+)
+audio_analyzer = AudioAnalyzer(workers=app.config['ANALYSIS_WORKERS'])
+background_jobs = ThreadPoolExecutor(max_workers=app.config['BACKGROUND_WORKERS'])
 
 # Google OAuth configuration
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -69,7 +120,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(256))  # scrypt hashes are longer than 128 chars
     profile_photo = db.Column(db.String(500), nullable=True, default=None)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     beats = db.relationship('Beat', backref='author', lazy=True)
@@ -79,8 +130,18 @@ class Beat(db.Model):
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     audio_url = db.Column(db.String(500), nullable=False)
+    manifest_url = db.Column(db.String(500), nullable=True, default=None)  # HLS master playlist
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    trending_score = db.Column(db.Float, nullable=False, default=0.0, index=True)  # Relative to TrendingState.epoch, see ranking.py
+    # Audio features filled in by analysis.py, None until the beat has been analysed
+    duration = db.Column(db.Float, nullable=True, index=True)  # Seconds
+    bpm = db.Column(db.Float, nullable=True, index=True)
+    loudness = db.Column(db.Float, nullable=True)  # dBFS
+    energy = db.Column(db.Float, nullable=True, index=True)  # Mean frame RMS, 0 to 1
+    spectral_centroid = db.Column(db.Float, nullable=True)  # Hz
+    spectral_rolloff = db.Column(db.Float, nullable=True)  # Hz
+    analyzed_at = db.Column(db.DateTime, nullable=True, index=True)
     comments = db.relationship('Comment', backref='beat', lazy=True)
     likes = db.relationship('Like', backref='beat', lazy=True)
 
@@ -98,22 +159,64 @@ class Like(db.Model):
     beat_id = db.Column(db.Integer, db.ForeignKey('beat.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class TrendingState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    epoch = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)
+    title = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default='open')  # open or completing
+
 def init_db():
     with app.app_context():
         db.create_all()
 
 def reset_db():
+    from ranking import seed_state
     with app.app_context():
         db.drop_all()
         db.create_all()
+        seed_state()
+
+def sweep_upload_sessions():
+    """Delete resumable uploads that expired before being completed"""
+    expired = UploadSession.query.filter(UploadSession.expires_at < datetime.utcnow()).all()
+    for session in expired:
+        remove_session_files(app.config['UPLOAD_SESSION_FOLDER'], session.id)
+        db.session.delete(session)
+    db.session.commit()
+    return len(expired)
+
+AUDIO_FEATURES = ['duration', 'bpm', 'loudness', 'energy', 'spectral_centroid', 'spectral_rolloff']
+
+def save_audio_features(beat_id, features):
+    """Store the output of analysis.extract_features on a beat"""
+    values = {name: features.get(name) for name in AUDIO_FEATURES}
+    values['analyzed_at'] = datetime.utcnow()
+    Beat.query.filter_by(id=beat_id).update(values, synchronize_session=False)
+    db.session.commit()
+
+@app.cli.command('sweep-uploads')
+def sweep_uploads_command():
+    """Remove expired resumable upload sessions and their chunks."""
+    print(f"Removed {sweep_upload_sessions()} expired upload sessions")
 
 # Import routes after models to avoid circular imports
 from routes import *
+from ranking import seed_state
 
 # Initialize database on startup
 with app.app_context():
     try:
         db.create_all()
+        seed_state()
     except Exception as e:
         print(f"Error creating database tables: {e}")
 
@@ -136,6 +239,7 @@ def clear_database():
     try:
         db.drop_all()
         db.create_all()
+        seed_state()
         return jsonify({"message": "Database cleared successfully"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -154,10 +258,15 @@ def register():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({"error": "Email already registered"}), 400
     
+    try:
+        password_hash = password_hasher.hash(data['password'])
+    except HashingBusy:
+        return jsonify({"error": "Server busy, please try again"}), 503, {"Retry-After": "1"}
+    
     user = User(
         username=data['username'],
         email=data['email'],
-        password_hash=generate_password_hash(data['password'])
+        password_hash=password_hash
     )
     
     db.session.add(user)
@@ -174,7 +283,26 @@ def login():
     data = request.get_json()
     user = User.query.filter_by(email=data.get('email')).first()
     
-    if user and check_password_hash(user.password_hash, data.get('password')):
+    # Google accounts have no password hash
+    if not user or not user.password_hash or not data.get('password'):
+        return jsonify({"error": "Invalid credentials"}), 401
+    
+    try:
+        valid = password_hasher.check(user.password_hash, data['password'])
+    except HashingBusy:
+        return jsonify({"error": "Server busy, please try again"}), 503, {"Retry-After": "1"}
+    
+    # Transparently upgrade hashes made with an older method or cost. This is
+    # best effort, a failure here must never reject a correct password.
+    if valid and password_hasher.needs_rehash(user.password_hash):
+        try:
+            user.password_hash = password_hasher.hash(data['password'])
+            db.session.commit()
+        except Exception as e:
+            print(f"Error upgrading password hash for user {user.id}: {e}")
+            db.session.rollback()
+    
+    if valid:
         access_token = create_access_token(identity=user.id)
         return jsonify({
             "token": access_token,
@@ -323,6 +451,15 @@ def admin_reset_db():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/admin/hash-metrics', methods=['GET'])
+def admin_hash_metrics():
+    admin_secret = request.headers.get('Admin-Secret')
+    if not admin_secret or admin_secret != app.config['ADMIN_SECRET']:
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    # Metrics are per gunicorn worker process
+    return jsonify({"pid": os.getpid(), **password_hasher.metrics()}), 200
+
 if __name__ == '__main__':
     app.run(debug=True)
 else:
@@ -0,0 +1,73 @@
+"""Benchmark feed latency while the server handles a login storm.
+
+Run against a running server (e.g. started from the Procfile command):
+
+    python bench_login_feed.py --url http://127.0.0.1:8000 --email you@example.com --password secret
+
+The feed is first measured on its own, then again while --login-threads
+clients log in as fast as they can, backing off for Retry-After when the
+server answers 503. With hashing offloaded to the worker pool and capped below
+the thread count, the feed p99 should stay close to the baseline.
+"""
+import argparse
+import threading
+import time
+import requests
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+
+def feed_client(url, stop, latencies):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(f"{url}/api/beats?page=1&per_page=10")
+        latencies.append(time.perf_counter() - start)
+
+def login_client(url, email, password, stop, statuses):
+    session = requests.Session()
+    while not stop.is_set():
+        response = session.post(f"{url}/api/auth/login", json={"email": email, "password": password})
+        statuses.append(response.status_code)
+        if response.status_code == 503:
+            # Back off like a well behaved client instead of hammering the server
+            stop.wait(float(response.headers.get('Retry-After', 1)))
+
+def run_phase(args, with_logins):
+    stop = threading.Event()
+    latencies, statuses = [], []
+    threads = [threading.Thread(target=feed_client, args=(args.url, stop, latencies))
+               for _ in range(args.feed_threads)]
+    if with_logins:
+        threads += [threading.Thread(target=login_client, args=(args.url, args.email, args.password, stop, statuses))
+                    for _ in range(args.login_threads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+def report(name, latencies, statuses):
+    print(f"{name}: {len(latencies)} feed requests, "
+          f"p50 {percentile(latencies, 0.50) or 0:.1f}ms, p99 {percentile(latencies, 0.99) or 0:.1f}ms")
+    if statuses:
+        counts = {code: statuses.count(code) for code in sorted(set(statuses))}
+        print(f"  logins: {len(statuses)} requests, status codes {counts}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--email', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--feed-threads', type=int, default=4)
+    parser.add_argument('--login-threads', type=int, default=32)
+    args = parser.parse_args()
+
+    report("Feed only", *run_phase(args, with_logins=False))
+    report("Feed during login storm", *run_phase(args, with_logins=True))
@@ -1,4 +1,5 @@
 from app import db, app
+from ranking import seed_state
 
 # Use Flask application context
 with app.app_context():
@@ -9,5 +10,6 @@ with app.app_context():
     # Recreate all tables
     print("Recreating all tables...")
     db.create_all()
+    seed_state()
 
     print("Database has been cleared successfully!")
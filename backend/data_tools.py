@@ -0,0 +1,361 @@
+"""Non-destructive data maintenance: streaming export/import and archival.
+
+    python data_tools.py export snapshot/ [--chunk-size 10000] [--gzip]
+    python data_tools.py import snapshot/ [--batch-size 1000] [--allow-existing]
+    python data_tools.py archive [--older-than-days 365]
+
+Export streams users, beats, likes and comments through a server-side cursor
+into chunked NDJSON files with a manifest, import loads them back with COPY on
+PostgreSQL or executemany batches elsewhere. Both keep memory bounded by one
+chunk and resume where they stopped when re-run on the same directory. The
+database is picked the same way as the app (DB_* env vars or local SQLite), so
+exporting without DB_* set and importing with them set migrates SQLite to RDS.
+Export reads a consistent snapshot: on PostgreSQL every table comes from one
+REPEATABLE READ transaction, and every run (resumed ones too) stops at the ids
+that existed when the export started.
+Import refuses to load into tables that already have rows unless
+--allow-existing is passed, and recomputes trending scores once it is done
+since the exported ones are relative to the source database's epoch.
+
+archive keeps the hot likes and comments small with PostgreSQL declarative
+partitioning. The first run turns like and comment into tables partitioned by
+created_at, with a default partition for recent rows, then every run moves
+whole years that ended more than --older-than-days ago into their own like_y<year>
+and comment_y<year> partitions. The app keeps querying like and comment as
+before and still sees every row. Other databases can't partition, so there
+archive leaves the tables alone.
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from app import app, db, User, Beat, Comment, Like
+from ranking import rebuild, seed_state
+
+# In dependency order, so foreign keys are satisfied on import
+TABLES = [User.__table__, Beat.__table__, Like.__table__, Comment.__table__]
+MANIFEST = 'manifest.json'
+IMPORT_PROGRESS = 'import_progress.json'
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    # Write then rename, so an interrupted run never leaves a truncated file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+def _open(path, mode, compressed):
+    if compressed:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _snapshot_bounds(table, high_water):
+    """Filters keeping table's rows, and the rows they reference, below the high-water marks"""
+    bounds = [table.c.id <= high_water[table.name]]
+    for fk in table.foreign_keys:
+        bounds.append(fk.parent <= high_water[fk.column.table.name])
+    return bounds
+
+def export_data(directory, chunk_size=10000, compress=False):
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = _read_json(manifest_path, {"created_at": datetime.utcnow().isoformat(), "tables": {}})
+
+    if db.engine.dialect.name == 'postgresql':
+        # Every table is read from the same snapshot, so likes and comments
+        # written during the export can't reference beats it has already passed
+        db.session.close()
+        db.session.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+    if "high_water" not in manifest:
+        # Ids only grow and beats and users are never deleted, so bounding every
+        # table by its max id at the start keeps resumed exports consistent too
+        manifest["high_water"] = {
+            table.name: db.session.execute(db.select(db.func.coalesce(db.func.max(table.c.id), 0))).scalar()
+            for table in TABLES
+        }
+        _write_json(manifest_path, manifest)
+
+    for table in TABLES:
+        entry = manifest["tables"].setdefault(table.name, {"columns": [c.name for c in table.columns], "parts": [], "done": False})
+        if entry["done"]:
+            print(f"{table.name}: already exported, skipping")
+            continue
+        last_id = entry["parts"][-1]["last_id"] if entry["parts"] else 0
+
+        # yield_per streams rows through a server-side cursor instead of loading the table
+        statement = db.select(table)\
+            .where(table.c.id > last_id, *_snapshot_bounds(table, manifest["high_water"]))\
+            .order_by(table.c.id)\
+            .execution_options(yield_per=chunk_size)
+        result = db.session.execute(statement)
+        for rows in result.partitions():
+            filename = f"{table.name}-{len(entry['parts']):05d}.ndjson" + ('.gz' if compress else '')
+            path = os.path.join(directory, filename)
+            with _open(f"{path}.tmp", 'w', compress) as f:
+                for row in rows:
+                    f.write(json.dumps({k: _serialize(v) for k, v in row._mapping.items()}) + '\n')
+            os.replace(f"{path}.tmp", path)
+            entry["parts"].append({"file": filename, "rows": len(rows), "first_id": rows[0].id, "last_id": rows[-1].id})
+            _write_json(manifest_path, manifest)
+            print(f"{table.name}: exported {sum(p['rows'] for p in entry['parts'])} rows")
+        result.close()
+
+        entry["done"] = True
+        _write_json(manifest_path, manifest)
+
+    db.session.close()
+    print("Export complete!")
+
+def _read_batches(path, table, batch_size):
+    datetime_columns = {c.name for c in table.columns if isinstance(c.type, db.DateTime)}
+    batch = []
+    with _open(path, 'r', path.endswith('.gz')) as f:
+        for line in f:
+            row = json.loads(line)
+            for name in datetime_columns:
+                if row.get(name):
+                    row[name] = datetime.fromisoformat(row[name])
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+def _copy_rows(table, columns, rows):
+    """Load rows with PostgreSQL COPY, which is much faster than INSERT"""
+    def field(value):
+        # Unquoted empty is NULL in CSV COPY, everything else is quoted
+        if value is None:
+            return ''
+        return '"' + str(_serialize(value)).replace('"', '""') + '"'
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(field(row.get(name)) for name in columns) + '\n')
+    buffer.seek(0)
+
+    quote = db.engine.dialect.identifier_preparer.quote
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {quote(table.name)} ({', '.join(quote(name) for name in columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+def _reset_sequence(table):
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence(:table, 'id'), COALESCE(MAX(id), 1)) FROM {db.engine.dialect.identifier_preparer.quote(table.name)}"
+        ), {"table": table.name})
+
+def _part_imported(table, path, batch_size):
+    """True if every row of a part file is already in the table.
+
+    Parts load in a single transaction, so a part that was started but not
+    recorded as completed is either entirely there or not there at all.
+    """
+    for rows in _read_batches(path, table, batch_size):
+        ids = [row["id"] for row in rows]
+        found = db.session.execute(
+            db.select(db.func.count()).select_from(table).where(table.c.id.in_(ids))
+        ).scalar()
+        if found < len(ids):
+            return False
+    return True
+
+def import_data(directory, batch_size=1000, allow_existing=False):
+    manifest = _read_json(os.path.join(directory, MANIFEST), None)
+    if not manifest:
+        raise SystemExit(f"No {MANIFEST} in {directory}")
+    progress_path = os.path.join(directory, IMPORT_PROGRESS)
+    progress = _read_json(progress_path, {})
+    use_copy = db.engine.dialect.name == 'postgresql'
+
+    db.create_all()
+    seed_state()
+    tables = [table for table in TABLES if table.name in manifest["tables"]]
+    if not allow_existing:
+        # Tables this tool already started loading are expected to have rows
+        not_empty = [
+            table.name for table in tables
+            if table.name not in progress and db.session.execute(db.select(table.c.id).limit(1)).first()
+        ]
+        if not_empty:
+            raise SystemExit(f"{', '.join(not_empty)} already contain rows, pass --allow-existing to import into them anyway")
+
+    for table in tables:
+        entry = manifest["tables"][table.name]
+        state = progress.setdefault(table.name, {"completed": [], "started": None})
+        for part in entry["parts"]:
+            if part["file"] in state["completed"]:
+                continue
+            path = os.path.join(directory, part["file"])
+            # Only a part this tool recorded as started can already be loaded,
+            # if it was committed before the progress file was updated
+            if state["started"] == part["file"] and _part_imported(table, path, batch_size):
+                print(f"{table.name}: {part['file']} was already imported")
+            else:
+                state["started"] = part["file"]
+                _write_json(progress_path, progress)
+                for rows in _read_batches(path, table, batch_size):
+                    if use_copy:
+                        _copy_rows(table, entry["columns"], rows)
+                    else:
+                        db.session.execute(table.insert(), rows)
+                db.session.commit()
+                print(f"{table.name}: imported {part['file']} ({part['rows']} rows)")
+            state["completed"].append(part["file"])
+            state["started"] = None
+            _write_json(progress_path, progress)
+        _reset_sequence(table)
+        db.session.commit()
+
+    # Exported scores are relative to the source database's trending epoch
+    print(f"Rebuilt trending scores for {rebuild(batch_size)} beats")
+    print("Import complete!")
+
+def _quote(name):
+    return db.engine.dialect.identifier_preparer.quote(name)
+
+def _restore_archive_tables(source):
+    """Move rows back from the <table>_archive_<year> tables older versions of archive created"""
+    pattern = re.compile(rf"^{source.name}_archive_\d{{4}}$")
+    columns = ', '.join(_quote(c.name) for c in source.columns)
+    for name in db.inspect(db.engine).get_table_names():
+        if pattern.match(name):
+            db.session.execute(db.text(f"INSERT INTO {_quote(source.name)} ({columns}) SELECT {columns} FROM {_quote(name)}"))
+            db.session.execute(db.text(f"DROP TABLE {_quote(name)}"))
+            db.session.commit()
+            print(f"{source.name}: restored rows from {name}")
+
+def _is_partitioned(source):
+    return db.session.execute(db.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"
+    ), {"name": _quote(source.name)}).scalar()
+
+def _partition(source):
+    """Rebuild source as a table partitioned by created_at, in one transaction.
+
+    Partition keys have to be part of the primary key, so it becomes
+    (id, created_at). The table is locked while its rows are copied.
+    """
+    name = source.name
+    old = f"{name}_unpartitioned"
+    columns = ', '.join(_quote(c.name) for c in source.columns)
+    select_columns = ', '.join(
+        "COALESCE(created_at, 'epoch')" if c.name == 'created_at' else _quote(c.name) for c in source.columns
+    )
+    sequence = db.session.execute(db.text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": _quote(name)}).scalar()
+    primary_key = db.session.execute(db.text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'p'"
+    ), {"name": _quote(name)}).scalar()
+
+    statements = [
+        f"ALTER TABLE {_quote(name)} RENAME TO {_quote(old)}",
+        # Index names are schema wide, free up the primary key's for the new table
+        f"ALTER TABLE {_quote(old)} RENAME CONSTRAINT {_quote(primary_key)} TO {_quote(old + '_pkey')}",
+        f"CREATE TABLE {_quote(name)} (LIKE {_quote(old)} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)",
+        f"ALTER TABLE {_quote(name)} ALTER COLUMN created_at SET NOT NULL",
+        f"ALTER TABLE {_quote(name)} ADD PRIMARY KEY (id, created_at)",
+        f"CREATE TABLE {_quote(name + '_default')} PARTITION OF {_quote(name)} DEFAULT",
+        f"ALTER SEQUENCE {sequence} OWNED BY {_quote(name)}.id",
+        f"INSERT INTO {_quote(name)} ({columns}) SELECT {select_columns} FROM {_quote(old)}",
+        f"DROP TABLE {_quote(old)}",
+    ]
+    # Added once the old table is gone so the constraints keep their names
+    for fk in sorted(source.foreign_keys, key=lambda fk: fk.parent.name):
+        column = fk.parent.name
+        statements += [
+            f"ALTER TABLE {_quote(name)} ADD CONSTRAINT {_quote(f'{name}_{column}_fkey')} FOREIGN KEY ({_quote(column)}) "
+            f"REFERENCES {_quote(fk.column.table.name)} ({_quote(fk.column.name)})",
+            f"CREATE INDEX {_quote(f'ix_{name}_{column}')} ON {_quote(name)} ({_quote(column)})",
+        ]
+    for statement in statements:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    print(f"{name}: partitioned by created_at")
+
+def _archive_year(source, year):
+    """Move one year of rows from the default partition into its own partition.
+
+    The rows are copied, deleted and the partition attached in one transaction,
+    so readers see them in the default partition until it commits.
+    """
+    name = source.name
+    partition = f"{name}_y{year}"
+    start, end = datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    bounds = {"start": start, "end": end}
+    where = "created_at >= :start AND created_at < :end"
+    db.session.execute(db.text(
+        f"CREATE TABLE {_quote(partition)} (LIKE {_quote(name)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    db.session.execute(db.text(
+        f"INSERT INTO {_quote(partition)} SELECT * FROM {_quote(name + '_default')} WHERE {where}"
+    ), bounds)
+    moved = db.session.execute(db.text(f"DELETE FROM {_quote(name + '_default')} WHERE {where}"), bounds).rowcount
+    db.session.execute(db.text(
+        f"ALTER TABLE {_quote(name)} ATTACH PARTITION {_quote(partition)} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    db.session.commit()
+    print(f"{name}: moved {moved} rows from {year} into {partition}")
+
+def archive_data(older_than_days=365):
+    # Only whole years move into a partition, those that ended before the cutoff
+    last_year = (datetime.utcnow() - timedelta(days=older_than_days)).year - 1
+    for source in (Like.__table__, Comment.__table__):
+        _restore_archive_tables(source)
+        if db.engine.dialect.name != 'postgresql':
+            print(f"{source.name}: partitioning needs PostgreSQL, leaving it as is")
+            continue
+        if not _is_partitioned(source):
+            _partition(source)
+
+        years = db.session.execute(db.text(
+            f"SELECT DISTINCT EXTRACT(YEAR FROM created_at)::int FROM {_quote(source.name + '_default')} "
+            f"WHERE created_at < :cutoff ORDER BY 1"
+        ), {"cutoff": datetime(last_year + 1, 1, 1)}).scalars().all()
+        for year in years:
+            _archive_year(source, year)
+
+    print("Archive complete!")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="BeatExchange data maintenance")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="Stream tables into chunked NDJSON files")
+    export_parser.add_argument('directory')
+    export_parser.add_argument('--chunk-size', type=int, default=10000)
+    export_parser.add_argument('--gzip', action='store_true')
+
+    import_parser = commands.add_parser('import', help="Load an export into the configured database")
+    import_parser.add_argument('directory')
+    import_parser.add_argument('--batch-size', type=int, default=1000)
+    import_parser.add_argument('--allow-existing', action='store_true', help="Import into tables that already have rows")
+
+    archive_parser = commands.add_parser('archive', help="Move old likes and comments into yearly partitions")
+    archive_parser.add_argument('--older-than-days', type=int, default=365)
+
+    args = parser.parse_args()
+    with app.app_context():
+        if args.command == 'export':
+            export_data(args.directory, args.chunk_size, args.gzip)
+        elif args.command == 'import':
+            import_data(args.directory, args.batch_size, args.allow_existing)
+        else:
+            archive_data(args.older_than_days)
@@ -8,10 +8,12 @@ firebase_admin.initialize_app(cred, {
 
 bucket = storage.bucket()
 
-def upload_file(local_file_path, destination_blob_name):
+def upload_file(local_file_path, destination_blob_name, content_type=None, cache_control=None):
     try:
         blob = bucket.blob(destination_blob_name)
-        blob.upload_from_filename(local_file_path)
+        if cache_control:
+            blob.cache_control = cache_control
+        blob.upload_from_filename(local_file_path, content_type=content_type)
         print(f"File {local_file_path} uploaded to {destination_blob_name}")
         
         # Get the public URL
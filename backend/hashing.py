@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+def _lower_priority(niceness):
+    os.nice(niceness)
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is full, callers should answer 503"""
+
+class PasswordHasher:
+    """Runs werkzeug password hashing in a bounded process pool.
+
+    Hashing is deliberately CPU heavy. Running it in separate processes keeps it
+    off the request threads (and the GIL). At most `workers` hashes run at once
+    and at most `queue_size` more wait (up to queue_timeout) for a process, any
+    request beyond that is rejected straight away. Every waiting request holds a
+    request thread, so workers + queue_size has to stay below the thread count
+    or a login storm can still queue every other endpoint behind it. The hashing
+    processes also run at a lower CPU priority, so request threads win when
+    cores are busy.
+    """
+
+    def __init__(self, method, workers=2, queue_size=16, queue_timeout=2.0, niceness=10, samples=1000):
+        # werkzeug fills in default parameters (e.g. "scrypt" is stored as
+        # "scrypt:32768:8:1"), hash once so needs_rehash compares like with like
+        self.method = generate_password_hash('', method).split('$', 1)[0]
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.niceness = niceness
+        self.max_pending = workers + queue_size
+        self._slots = threading.BoundedSemaphore(workers)
+        self._pending = 0
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._latencies = deque(maxlen=samples)
+        self._completed = 0
+        self._rejected = 0
+        self._in_flight = 0
+
+    def _get_pool(self):
+        # Created lazily so each gunicorn worker gets its own pool after fork
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    # Not fork: forking this multi-threaded process can copy a lock
+                    # held by another request thread into the child, which then deadlocks
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('forkserver'),
+                        initializer=_lower_priority,
+                        initargs=(self.niceness,)
+                    )
+        return self._pool
+
+    def _reset_pool(self, broken):
+        # Only drop the pool that failed, another thread may already have replaced it
+        with self._pool_lock:
+            if self._pool is broken:
+                self._pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _admit(self):
+        """Take a process slot, or raise HashingBusy if the queue is full or too slow"""
+        with self._metrics_lock:
+            admitted = self._pending < self.max_pending
+            if admitted:
+                self._pending += 1
+            else:
+                self._rejected += 1
+        if not admitted:
+            raise HashingBusy("Too many password hashing requests")
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._metrics_lock:
+                self._pending -= 1
+                self._rejected += 1
+            raise HashingBusy("Timed out waiting for a password hashing process")
+
+    def _run(self, fn, *args):
+        self._admit()
+        start = time.perf_counter()
+        with self._metrics_lock:
+            self._in_flight += 1
+        try:
+            pool = self._get_pool()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                # A child died (e.g. killed for memory), start a fresh pool and retry once
+                self._reset_pool(pool)
+                return self._get_pool().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+            with self._metrics_lock:
+                self._pending -= 1
+                self._in_flight -= 1
+                self._completed += 1
+                self._latencies.append(time.perf_counter() - start)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was created with a different method or cost than configured"""
+        return pwhash.split('$', 1)[0] != self.method
+
+    def metrics(self):
+        with self._metrics_lock:
+            latencies = sorted(self._latencies)
+            completed, rejected, in_flight = self._completed, self._rejected, self._in_flight
+            waiting = self._pending - self._in_flight
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            "method": self.method,
+            "workers": self.workers,
+            "in_flight": in_flight,
+            "waiting": waiting,
+            "completed": completed,
+            "rejected": rejected,
+            "latency_ms": {
+                "p50": percentile(0.50),
+                "p90": percentile(0.90),
+                "p99": percentile(0.99),
+                "max": percentile(1.0)
+            }
+        }
@@ -1,6 +1,8 @@
 from app import app, db
+from ranking import seed_state
 
 with app.app_context():
     db.drop_all()  # Clear existing tables
     db.create_all()  # Create new tables
+    seed_state()
     print("Database initialized successfully!")
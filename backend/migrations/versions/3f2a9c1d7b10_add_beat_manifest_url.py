@@ -0,0 +1,85 @@
+"""add beat.manifest_url
+
+Revision ID: 3f2a9c1d7b10
+Revises:
+Create Date: 2026-10-19 09:00:00.000000
+
+First revision. Databases created before migrations existed (by db.create_all())
+already have the base tables, so they are only created when missing, and the
+app's own create_all() on startup may already have added new columns too.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    if not _has_table('user'):
+        op.create_table('user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=80), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password_hash', sa.String(length=128), nullable=True),
+            sa.Column('profile_photo', sa.String(length=500), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    if not _has_table('beat'):
+        op.create_table('beat',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=100), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('audio_url', sa.String(length=500), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not _has_table('comment'):
+        op.create_table('comment',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.Float(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('beat_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['beat_id'], ['beat.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not _has_table('like'):
+        op.create_table('like',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('beat_id', sa.Integer(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['beat_id'], ['beat.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if not _has_column('beat', 'manifest_url'):
+        with op.batch_alter_table('beat') as batch_op:
+            batch_op.add_column(sa.Column('manifest_url', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('beat') as batch_op:
+        batch_op.drop_column('manifest_url')
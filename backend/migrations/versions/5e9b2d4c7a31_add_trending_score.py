@@ -0,0 +1,61 @@
+"""add beat.trending_score and trending_state
+
+Revision ID: 5e9b2d4c7a31
+Revises: c7d3f5a81e42
+Create Date: 2026-10-19 09:30:00.000000
+
+Existing beats start at a score of 0, run `flask trending-rebuild` once after
+upgrading to score them from their likes and comments.
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e9b2d4c7a31'
+down_revision = 'c7d3f5a81e42'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def _has_index(table, index):
+    return index in [i['name'] for i in sa.inspect(op.get_bind()).get_indexes(table)]
+
+
+def upgrade():
+    if not _has_column('beat', 'trending_score'):
+        with op.batch_alter_table('beat') as batch_op:
+            batch_op.add_column(sa.Column('trending_score', sa.Float(), nullable=False, server_default='0'))
+    if not _has_index('beat', 'ix_beat_trending_score'):
+        op.create_index(op.f('ix_beat_trending_score'), 'beat', ['trending_score'], unique=False)
+    if not _has_index('beat', 'ix_beat_created_at'):
+        op.create_index(op.f('ix_beat_created_at'), 'beat', ['created_at'], unique=False)
+
+    if not _has_table('trending_state'):
+        op.create_table('trending_state',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('epoch', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    # Seeded here so concurrent first writers never race to insert it
+    trending_state = sa.table('trending_state', sa.column('id', sa.Integer), sa.column('epoch', sa.DateTime))
+    if not op.get_bind().execute(sa.select(trending_state.c.id).where(trending_state.c.id == 1)).first():
+        op.bulk_insert(trending_state, [{'id': 1, 'epoch': datetime.utcnow()}])
+
+
+def downgrade():
+    op.drop_table('trending_state')
+    op.drop_index(op.f('ix_beat_created_at'), table_name='beat')
+    op.drop_index(op.f('ix_beat_trending_score'), table_name='beat')
+    with op.batch_alter_table('beat') as batch_op:
+        batch_op.drop_column('trending_score')
@@ -0,0 +1,51 @@
+"""add upload_session
+
+Revision ID: 8b41e6d2a955
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-19 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41e6d2a955'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def upgrade():
+    if not _has_table('upload_session'):
+        op.create_table('upload_session',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('filename', sa.String(length=255), nullable=False),
+            sa.Column('total_size', sa.BigInteger(), nullable=False),
+            sa.Column('title', sa.String(length=100), nullable=False),
+            sa.Column('description', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.Column('status', sa.String(length=16), nullable=False, server_default='open'),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(op.f('ix_upload_session_expires_at'), 'upload_session', ['expires_at'], unique=False)
+    elif not _has_column('upload_session', 'status'):
+        # Created by create_all() before the status column existed
+        with op.batch_alter_table('upload_session') as batch_op:
+            batch_op.add_column(sa.Column('status', sa.String(length=16), nullable=False, server_default='open'))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_upload_session_expires_at'), table_name='upload_session')
+    op.drop_table('upload_session')
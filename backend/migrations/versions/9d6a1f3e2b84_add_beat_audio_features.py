@@ -0,0 +1,56 @@
+"""add beat audio features
+
+Revision ID: 9d6a1f3e2b84
+Revises: 5e9b2d4c7a31
+Create Date: 2026-10-19 09:40:00.000000
+
+Existing beats are left unanalysed, run analyze_beats.py to backfill them.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d6a1f3e2b84'
+down_revision = '5e9b2d4c7a31'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    ('duration', sa.Float(), True),
+    ('bpm', sa.Float(), True),
+    ('loudness', sa.Float(), False),
+    ('energy', sa.Float(), True),
+    ('spectral_centroid', sa.Float(), False),
+    ('spectral_rolloff', sa.Float(), False),
+    ('analyzed_at', sa.DateTime(), True),
+]
+
+
+def _has_column(table, column):
+    return column in [c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def _has_index(table, index):
+    return index in [i['name'] for i in sa.inspect(op.get_bind()).get_indexes(table)]
+
+
+def upgrade():
+    missing = [(name, type_) for name, type_, _ in COLUMNS if not _has_column('beat', name)]
+    if missing:
+        with op.batch_alter_table('beat') as batch_op:
+            for name, type_ in missing:
+                batch_op.add_column(sa.Column(name, type_, nullable=True))
+    for name, _, indexed in COLUMNS:
+        if indexed and not _has_index('beat', f'ix_beat_{name}'):
+            op.create_index(op.f(f'ix_beat_{name}'), 'beat', [name], unique=False)
+
+
+def downgrade():
+    for name, _, indexed in reversed(COLUMNS):
+        if indexed:
+            op.drop_index(op.f(f'ix_beat_{name}'), table_name='beat')
+    with op.batch_alter_table('beat') as batch_op:
+        for name, _, _ in reversed(COLUMNS):
+            batch_op.drop_column(name)
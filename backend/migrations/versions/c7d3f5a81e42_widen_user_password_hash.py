@@ -0,0 +1,39 @@
+"""widen user.password_hash to 256 chars
+
+Revision ID: c7d3f5a81e42
+Revises: 8b41e6d2a955
+Create Date: 2026-10-19 09:20:00.000000
+
+PASSWORD_HASH_METHOD now defaults to scrypt (Werkzeug 2.3 still defaults to
+pbkdf2:sha256:600000), and scrypt hashes are 162 chars so they don't fit in 128.
+Every existing user is rehashed with scrypt on their next login.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3f5a81e42'
+down_revision = '8b41e6d2a955'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite ignores VARCHAR lengths, only real databases need the ALTER
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('user', 'password_hash',
+        existing_type=sa.String(length=128),
+        type_=sa.String(length=256),
+        existing_nullable=True)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('user', 'password_hash',
+        existing_type=sa.String(length=256),
+        type_=sa.String(length=128),
+        existing_nullable=True)
@@ -0,0 +1,157 @@
+"""Time-decayed "trending" scores for beats.
+
+Scores use forward decay: an engagement at time t adds
+weight * 2 ** ((t - epoch) / half_life) to Beat.trending_score. Newer
+engagement is worth exponentially more, which orders beats exactly like
+decaying every score over time would, but each like or comment only touches
+its own beat's row. The indexed trending_score column then serves the top-K
+directly. Stored values grow with time, so once the epoch is older than
+TRENDING_RESCALE_AFTER_DAYS the next engagement starts rescale() in the
+background, which moves the epoch forward and shrinks every score by the same
+factor.
+"""
+import threading
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import app, db, Beat, Comment, Like, TrendingState, background_jobs
+
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+BEAT_WEIGHT = 1.0  # Lets fresh uploads show up before they get any engagement
+# 2 ** 1024 overflows a float. Rescaling keeps exponents far below this, the
+# cap only stops scores from failing if rescaling has not run for a long time.
+MAX_EXPONENT = 512
+
+# Held while a background rescale is queued or running in this process
+_rescale_lock = threading.Lock()
+
+def _half_life_seconds():
+    return app.config['TRENDING_HALF_LIFE_HOURS'] * 3600
+
+def _growth(since, at):
+    """Multiplier for an engagement at `at` relative to the epoch `since`"""
+    return 2 ** min((at - since).total_seconds() / _half_life_seconds(), MAX_EXPONENT)
+
+def _get_state(for_update=False, shared=False):
+    """The single TrendingState row, seeded by the migration and at startup.
+
+    Score updates take a shared lock on it and rescale() an exclusive one, so
+    no increment can be computed against an epoch that is being replaced.
+    """
+    query = TrendingState.query
+    if for_update or shared:
+        query = query.with_for_update(read=shared)
+    state = query.get(1)
+    if not state:
+        raise RuntimeError("trending_state is not seeded, run 'flask db upgrade'")
+    return state
+
+def seed_state():
+    """Create the TrendingState row if missing, safe to call from every worker"""
+    if TrendingState.query.get(1):
+        return
+    try:
+        db.session.add(TrendingState(id=1, epoch=datetime.utcnow()))
+        db.session.commit()
+    except IntegrityError:
+        # Another worker seeded it first
+        db.session.rollback()
+
+def record_engagement(beat_id, weight, at=None):
+    """Add (or with a negative weight remove) engagement to a beat's score.
+
+    Only queues the update on the current session, the caller commits it
+    together with the like or comment that caused it. Removals should pass the
+    original engagement's created_at so exactly its contribution is removed.
+    """
+    at = at or datetime.utcnow()
+    state = _get_state(shared=True)
+    db.session.query(Beat).filter(Beat.id == beat_id).update(
+        {Beat.trending_score: Beat.trending_score + weight * _growth(state.epoch, at)},
+        synchronize_session=False
+    )
+    if _is_due(state) and _rescale_lock.acquire(blocking=False):
+        try:
+            background_jobs.submit(_rescale_in_background)
+        except Exception as e:
+            _rescale_lock.release()
+            print(f"Error queueing trending rescale: {e}")
+
+def _rescale_in_background():
+    # Runs in its own app context and session, it waits for the request that
+    # queued it to commit and release its shared lock on the state row
+    try:
+        with app.app_context():
+            rescale()
+    except Exception as e:
+        print(f"Error rescaling trending scores: {e}")
+    finally:
+        _rescale_lock.release()
+
+def _is_due(state):
+    age = datetime.utcnow() - state.epoch
+    return age.total_seconds() > app.config['TRENDING_RESCALE_AFTER_DAYS'] * 86400
+
+def rescale_due():
+    return _is_due(_get_state())
+
+def rescale():
+    """Move the epoch to now and shrink all scores so they stay in float range.
+
+    Returns the factor scores were multiplied by, or None if another worker
+    already rescaled them.
+    """
+    state = _get_state(for_update=True)
+    if not _is_due(state):
+        db.session.rollback()
+        return None
+    now = datetime.utcnow()
+    factor = 1 / _growth(state.epoch, now)
+    db.session.query(Beat).update(
+        {Beat.trending_score: Beat.trending_score * factor},
+        synchronize_session=False
+    )
+    state.epoch = now
+    db.session.commit()
+    return factor
+
+def rebuild(batch_size=1000):
+    """Recompute every score from the full Beat, Like and Comment history"""
+    state = _get_state(for_update=True)
+    state.epoch = datetime.utcnow()
+    scores = {}
+
+    def add(rows, weight):
+        for beat_id, created_at in rows:
+            if created_at:
+                scores[beat_id] = scores.get(beat_id, 0.0) + weight * _growth(state.epoch, created_at)
+
+    add(db.session.query(Beat.id, Beat.created_at).yield_per(batch_size), BEAT_WEIGHT)
+    add(db.session.query(Like.beat_id, Like.created_at).yield_per(batch_size), LIKE_WEIGHT)
+    add(db.session.query(Comment.beat_id, Comment.created_at).yield_per(batch_size), COMMENT_WEIGHT)
+
+    db.session.query(Beat).update({Beat.trending_score: 0.0}, synchronize_session=False)
+    items = list(scores.items())
+    for i in range(0, len(items), batch_size):
+        db.session.execute(
+            Beat.__table__.update()
+            .where(Beat.__table__.c.id == db.bindparam('b_id'))
+            .values(trending_score=db.bindparam('b_score')),
+            [{'b_id': beat_id, 'b_score': score} for beat_id, score in items[i:i + batch_size]]
+        )
+    db.session.commit()
+    return len(scores)
+
+@app.cli.command('trending-rescale')
+def rescale_command():
+    """Rescale trending scores now instead of on the next engagement."""
+    factor = rescale()
+    if factor:
+        print(f"Rescaled trending scores by {factor:.3g}")
+    else:
+        print("Trending scores do not need rescaling yet")
+
+@app.cli.command('trending-rebuild')
+def rebuild_command():
+    """Recompute trending scores from all likes and comments."""
+    print(f"Rebuilt trending scores for {rebuild()} beats")
@@ -0,0 +1,139 @@
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+
+# Chunks are streamed to disk in pieces of this size so memory stays bounded
+# no matter how large a chunk or the assembled recording is.
+COPY_BUFFER_SIZE = 64 * 1024
+
+class ChunkConflict(ValueError):
+    """Raised for a chunk overlapping bytes already received at another offset"""
+
+def new_upload_id():
+    return uuid.uuid4().hex
+
+def session_dir(session_folder, upload_id):
+    return os.path.join(session_folder, upload_id)
+
+def create_session_dir(session_folder, upload_id):
+    os.makedirs(session_dir(session_folder, upload_id), exist_ok=True)
+
+def expiry_from_now(ttl):
+    return datetime.utcnow() + timedelta(seconds=ttl)
+
+def _chunk_filename(offset):
+    return f"{offset:015d}.part"
+
+def check_chunk(session_folder, upload_id, offset, length):
+    """Reject chunks overlapping received bytes, unless they exactly replace a chunk.
+
+    This keeps the bytes stored for a session at or below its total size.
+    """
+    end = offset + length
+    for chunk_offset, chunk_length in list_chunks(session_folder, upload_id):
+        if (chunk_offset, chunk_length) == (offset, length):
+            continue
+        if chunk_offset < end and offset < chunk_offset + chunk_length:
+            raise ChunkConflict(
+                f"Chunk overlaps bytes {chunk_offset}-{chunk_offset + chunk_length} already received"
+            )
+
+def write_chunk(session_folder, upload_id, offset, stream, length):
+    """Stream a chunk body to disk and return the number of bytes written.
+
+    The chunk is written under a temporary name and renamed into place, so a
+    dropped connection never leaves a partial chunk behind and chunks for
+    different offsets can arrive in parallel from several workers. Overlaps
+    are checked again right before the rename to catch concurrent chunks.
+
+    The session directory is never recreated here, a chunk arriving after the
+    upload was completed or cancelled raises FileNotFoundError instead of
+    leaving an orphaned directory behind.
+    """
+    directory = session_dir(session_folder, upload_id)
+    final_path = os.path.join(directory, _chunk_filename(offset))
+    temp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+
+    written = 0
+    try:
+        with open(temp_path, 'wb') as f:
+            while written < length:
+                data = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                written += len(data)
+        if written != length:
+            raise IOError(f"Expected {length} bytes, received {written}")
+        check_chunk(session_folder, upload_id, offset, length)
+        os.replace(temp_path, final_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return written
+
+def list_chunks(session_folder, upload_id):
+    """Return the stored chunks as a sorted list of (offset, length)"""
+    directory = session_dir(session_folder, upload_id)
+    if not os.path.isdir(directory):
+        return []
+    chunks = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.part'):
+            continue
+        offset = int(filename[:-len('.part')])
+        chunks.append((offset, os.path.getsize(os.path.join(directory, filename))))
+    return sorted(chunks)
+
+def received_ranges(chunks):
+    """Merge (offset, length) chunks into contiguous [start, end) byte ranges"""
+    ranges = []
+    for offset, length in chunks:
+        end = offset + length
+        if ranges and offset <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([offset, end])
+    return ranges
+
+def missing_ranges(ranges, total_size):
+    """Byte ranges of [0, total_size) not covered by any received range"""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < total_size:
+        missing.append([position, total_size])
+    return missing
+
+def assemble(session_folder, upload_id, total_size, destination_path):
+    """Concatenate the chunks of a complete upload into destination_path.
+
+    Chunks written by older versions may overlap, bytes that were already
+    written are skipped.
+    """
+    directory = session_dir(session_folder, upload_id)
+    position = 0
+    try:
+        with open(destination_path, 'wb') as out:
+            for offset, length in list_chunks(session_folder, upload_id):
+                if offset > position:
+                    raise ValueError(f"Missing bytes {position}-{offset}")
+                if offset + length <= position:
+                    continue
+                with open(os.path.join(directory, _chunk_filename(offset)), 'rb') as chunk:
+                    chunk.seek(position - offset)
+                    shutil.copyfileobj(chunk, out, COPY_BUFFER_SIZE)
+                position = offset + length
+        if position != total_size:
+            raise ValueError(f"Assembled {position} bytes, expected {total_size}")
+    except Exception:
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        raise
+
+def remove_session_files(session_folder, upload_id):
+    shutil.rmtree(session_dir(session_folder, upload_id), ignore_errors=True)
@@ -2,10 +2,19 @@ from flask import jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_cors import cross_origin
 from werkzeug.utils import secure_filename
-from app import app, db, User, Beat, Comment, Like
+from app import (
+    app, db, User, Beat, Comment, Like, UploadSession,
+    sweep_upload_sessions, audio_analyzer, background_jobs, save_audio_features
+)
 from datetime import datetime
 import os
 from firestore import upload_file
+from streaming import package_beat
+from ranking import record_engagement, LIKE_WEIGHT, COMMENT_WEIGHT, BEAT_WEIGHT
+from resumable import (
+    ChunkConflict, check_chunk, create_session_dir, new_upload_id, expiry_from_now, write_chunk, list_chunks,
+    received_ranges, missing_ranges, assemble, remove_session_files
+)
 from sqlalchemy import distinct
 
 # Create uploads directory if it doesn't exist
@@ -40,38 +49,277 @@ def create_beat():
     temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     audio_file.save(temp_path)
     
+    return publish_beat(
+        temp_path,
+        filename,
+        request.form.get('title', 'Untitled Beat'),
+        request.form.get('description', ''),
+        get_jwt_identity()
+    )
+
+def publish_beat(temp_path, filename, title, description, user_id):
+    """Upload a locally saved recording to storage and create its Beat"""
     # Upload to Firebase Storage
     firebase_url = upload_file(temp_path, filename)
     if not firebase_url:
+        os.remove(temp_path)
         return jsonify({"error": "Failed to upload file to storage"}), 500
     
-    # Remove temporary file
-    os.remove(temp_path)
-    
     beat = Beat(
-        title=request.form.get('title', 'Untitled Beat'),
-        description=request.form.get('description', ''),
+        title=title,
+        description=description,
         audio_url=firebase_url,  
-        user_id=get_jwt_identity()
+        user_id=user_id
     )
     db.session.add(beat)
+    db.session.flush()
+    record_engagement(beat.id, BEAT_WEIGHT)
     db.session.commit()
     
+    # Packaging and analysis run in the background, manifest_url and the audio
+    # features are filled in once they finish
+    background_jobs.submit(postprocess_beat, beat.id, temp_path)
+    
     return jsonify({
         "message": "Beat uploaded successfully",
         "beat": {
             "id": beat.id,
             "title": beat.title,
             "description": beat.description,
-            "audio_url": beat.audio_url  
+            "audio_url": beat.audio_url,
+            "manifest_url": get_full_url(beat.manifest_url) if beat.manifest_url else None
         }
     }), 201
 
+def postprocess_beat(beat_id, temp_path):
+    """Background job run after a beat has been published"""
+    try:
+        # Split into HLS segments for fast playback start, audio_url stays the fallback
+        manifest_url = package_beat(temp_path, os.path.basename(temp_path), app.config['UPLOAD_FOLDER'])
+        if manifest_url:
+            with app.app_context():
+                Beat.query.filter_by(id=beat_id).update({'manifest_url': manifest_url})
+                db.session.commit()
+    except Exception as e:
+        print(f"Error packaging beat {beat_id}: {e}")
+    
+    # Extract tempo, loudness and spectral features, the temporary file is
+    # removed once the analysis has read it
+    try:
+        audio_analyzer.submit(temp_path, analysis_callback(beat_id, temp_path))
+    except Exception as e:
+        print(f"Error queueing analysis of beat {beat_id}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def analysis_callback(beat_id, temp_path):
+    def on_done(future):
+        try:
+            features = future.result()
+            with app.app_context():
+                save_audio_features(beat_id, features)
+        except Exception as e:
+            print(f"Error analysing beat {beat_id}: {e}")
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return on_done
+
+# Resumable upload routes
+def get_upload_session(upload_id):
+    """Return the caller's upload session, or an error response tuple"""
+    session = UploadSession.query.get(upload_id)
+    if not session or session.user_id != get_jwt_identity():
+        return None, (jsonify({"error": "Upload not found"}), 404)
+    if session.expires_at < datetime.utcnow():
+        return None, (jsonify({"error": "Upload expired"}), 410)
+    return session, None
+
+def upload_status(session):
+    ranges = received_ranges(list_chunks(app.config['UPLOAD_SESSION_FOLDER'], session.id))
+    missing = missing_ranges(ranges, session.total_size)
+    return {
+        "upload_id": session.id,
+        "size": session.total_size,
+        "chunk_size": app.config['UPLOAD_CHUNK_SIZE'],
+        "received": ranges,
+        "missing": missing,
+        "complete": not missing,
+        "status": session.status,
+        "expires_at": session.expires_at.isoformat()
+    }
+
+@app.route('/api/uploads', methods=['POST'])
+@jwt_required()
+@cross_origin()
+def create_upload():
+    """Start a resumable upload, chunks are then sent with PUT /api/uploads/<id>"""
+    data = request.get_json()
+    if not data or 'filename' not in data or 'size' not in data:
+        return jsonify({"error": "Missing required fields"}), 400
+
+    try:
+        total_size = int(data['size'])
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid size"}), 400
+    if total_size <= 0 or total_size > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({"error": f"Size must be between 1 and {app.config['MAX_UPLOAD_SIZE']} bytes"}), 400
+
+    filename = secure_filename(data['filename'])
+    if not filename:
+        return jsonify({"error": "Invalid filename"}), 400
+
+    # Opportunistically clean up abandoned uploads
+    sweep_upload_sessions()
+
+    session = UploadSession(
+        id=new_upload_id(),
+        user_id=get_jwt_identity(),
+        filename=filename,
+        total_size=total_size,
+        title=data.get('title', 'Untitled Beat'),
+        description=data.get('description', ''),
+        expires_at=expiry_from_now(app.config['UPLOAD_SESSION_TTL'])
+    )
+    db.session.add(session)
+    db.session.commit()
+    create_session_dir(app.config['UPLOAD_SESSION_FOLDER'], session.id)
+
+    return jsonify(upload_status(session)), 201
+
+@app.route('/api/uploads/<string:upload_id>', methods=['PUT'])
+@jwt_required()
+@cross_origin()
+def upload_chunk(upload_id):
+    """Store one chunk at ?offset=N. Chunks may be sent in parallel and in any order."""
+    session, error = get_upload_session(upload_id)
+    if error:
+        return error
+
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or offset < 0:
+        return jsonify({"error": "Missing or invalid offset"}), 400
+    if not length:
+        return jsonify({"error": "Missing Content-Length"}), 411
+    if offset + length > session.total_size:
+        return jsonify({"error": "Chunk extends past the end of the upload"}), 416
+    if session.status != 'open':
+        return jsonify({"error": "Upload is being completed"}), 409
+
+    try:
+        check_chunk(app.config['UPLOAD_SESSION_FOLDER'], session.id, offset, length)
+        write_chunk(app.config['UPLOAD_SESSION_FOLDER'], session.id, offset, request.stream, length)
+    except ChunkConflict as e:
+        return jsonify({"error": str(e)}), 409
+    except FileNotFoundError:
+        # Completed or cancelled while this chunk was being received
+        return jsonify({"error": "Upload is no longer open"}), 409
+    except IOError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(upload_status(session)), 200
+
+@app.route('/api/uploads/<string:upload_id>', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def get_upload(upload_id):
+    """Report which byte ranges have been received so a client can resume"""
+    session, error = get_upload_session(upload_id)
+    if error:
+        return error
+    return jsonify(upload_status(session)), 200
+
+@app.route('/api/uploads/<string:upload_id>/complete', methods=['POST'])
+@jwt_required()
+@cross_origin()
+def complete_upload(upload_id):
+    """Assemble the received chunks and create the Beat"""
+    session, error = get_upload_session(upload_id)
+    if error:
+        return error
+
+    status = upload_status(session)
+    if not status['complete']:
+        return jsonify({"error": "Upload is incomplete", "missing": status['missing']}), 409
+
+    # Claim the session so concurrent completes can't publish the beat twice
+    claimed = UploadSession.query.filter_by(id=session.id, status='open')\
+        .update({'status': 'completing'}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return jsonify({"error": "Upload is already being completed"}), 409
+
+    filename = secure_filename(f"{datetime.utcnow().timestamp()}_{session.filename}")
+    temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        assemble(app.config['UPLOAD_SESSION_FOLDER'], session.id, session.total_size, temp_path)
+    except (IOError, ValueError) as e:
+        reopen_upload(session.id)
+        return jsonify({"error": str(e)}), 409
+
+    # The chunks are only dropped once the beat is published, so a failed
+    # storage upload can be retried without sending the recording again
+    upload_id = session.id
+    response, status_code = publish_beat(temp_path, filename, session.title, session.description, session.user_id)
+    if status_code != 201:
+        reopen_upload(upload_id)
+        return response, status_code
+
+    remove_session_files(app.config['UPLOAD_SESSION_FOLDER'], upload_id)
+    UploadSession.query.filter_by(id=upload_id).delete(synchronize_session=False)
+    db.session.commit()
+    return response, status_code
+
+def reopen_upload(upload_id):
+    UploadSession.query.filter_by(id=upload_id).update({'status': 'open'}, synchronize_session=False)
+    db.session.commit()
+
+@app.route('/api/uploads/<string:upload_id>', methods=['DELETE'])
+@jwt_required()
+@cross_origin()
+def cancel_upload(upload_id):
+    session, error = get_upload_session(upload_id)
+    if error:
+        return error
+    if session.status != 'open':
+        return jsonify({"error": "Upload is being completed"}), 409
+    remove_session_files(app.config['UPLOAD_SESSION_FOLDER'], session.id)
+    db.session.delete(session)
+    db.session.commit()
+    return jsonify({"message": "Upload cancelled"}), 200
+
 @app.route('/api/beats', methods=['GET'])
 @cross_origin()
 def get_beats():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int)
+    sort = request.args.get('sort', 'recent')
+    
+    if sort == 'trending':
+        ordering = (Beat.trending_score.desc(), Beat.id.desc())
+    else:
+        ordering = (Beat.created_at.desc(), Beat.id.desc())
+    
+    # Optional audio feature filters, served by the indexes on the feature columns
+    filters = []
+    feature_filters = [
+        ('bpm_min', Beat.bpm), ('bpm_max', Beat.bpm),
+        ('duration_min', Beat.duration), ('duration_max', Beat.duration),
+        ('energy_min', Beat.energy), ('energy_max', Beat.energy)
+    ]
+    for arg, column in feature_filters:
+        value = request.args.get(arg, type=float)
+        if value is not None:
+            filters.append(column >= value if arg.endswith('_min') else column <= value)
+    
+    # Pick the page from the index on the sort column, then aggregate only those
+    # beats. One extra row tells whether there is a next page, so the feed never
+    # has to count every matching beat.
+    page, per_page = max(page, 1), max(per_page, 1)
+    rows = Beat.query.with_entities(Beat.id).filter(*filters).order_by(*ordering)\
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+    page_ids = [row.id for row in rows[:per_page]]
     
     # Build the base query with proper join conditions
     query = db.session.query(
@@ -79,7 +327,11 @@ def get_beats():
         Beat.title,
         Beat.description,
         Beat.audio_url,
+        Beat.manifest_url,
         Beat.created_at,
+        Beat.duration,
+        Beat.bpm,
+        Beat.energy,
         User.username.label('author'),
         User.profile_photo.label('author_photo'),
         db.func.count(distinct(Like.id)).label('likes_count'),
@@ -88,15 +340,13 @@ def get_beats():
     .join(User, Beat.user_id == User.id)\
     .outerjoin(Like, Beat.id == Like.beat_id)\
     .outerjoin(Comment, Beat.id == Comment.beat_id)\
+    .filter(Beat.id.in_(page_ids))\
     .group_by(Beat.id, User.username, User.profile_photo)\
-    .order_by(Beat.created_at.desc())
+    .order_by(*ordering)
     
-    # Get paginated results
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-
     # Get beats with their comments
     beats_with_details = []
-    for beat in pagination.items:
+    for beat in query.all():
         comments = Comment.query.filter_by(beat_id=beat.id)\
             .order_by(Comment.timestamp)\
             .limit(3)\
@@ -107,10 +357,14 @@ def get_beats():
             'title': beat.title,
             'description': beat.description,
             'audio_url': get_full_url(beat.audio_url),
+            'manifest_url': get_full_url(beat.manifest_url) if beat.manifest_url else None,
             'author': beat.author,
             'created_at': beat.created_at.isoformat(),
             'likes_count': beat.likes_count,
             'comments_count': beat.comments_count,
+            'duration': beat.duration,
+            'bpm': beat.bpm,
+            'energy': beat.energy,
             'author_photo': get_full_url(beat.author_photo) if beat.author_photo else None,
             'comments': [{
                 'id': comment.id,
@@ -124,9 +378,8 @@ def get_beats():
     
     return jsonify({
         'beats': beats_with_details,
-        'total': pagination.total,
-        'pages': pagination.pages,
-        'current_page': pagination.page
+        'has_more': len(rows) > per_page,
+        'current_page': page
     }), 200
 
 @app.route('/api/users/<string:username>/beats', methods=['GET'])
@@ -145,6 +398,7 @@ def get_user_beats(username):
         'title': beat.title,
         'description': beat.description,
         'audio_url': get_full_url(beat.audio_url),
+        'manifest_url': get_full_url(beat.manifest_url) if beat.manifest_url else None,
         'author': beat.author.username if beat.author else 'Unknown User',
         'created_at': beat.created_at.isoformat(),
         'likes_count': len(beat.likes),
@@ -162,6 +416,7 @@ def get_my_beats():
         'title': beat.title,
         'description': beat.description,
         'audio_url': get_full_url(beat.audio_url),
+        'manifest_url': get_full_url(beat.manifest_url) if beat.manifest_url else None,
         'author': beat.author.username if beat.author else 'Unknown User',
         'created_at': beat.created_at.isoformat(),
         'likes_count': len(beat.likes),
@@ -209,10 +464,12 @@ def add_beat_comment(beat_id):
             content=data['content'],
             timestamp=float(data['timestamp']),
             user_id=current_user_id,
-            beat_id=beat_id
+            beat_id=beat_id,
+            created_at=datetime.utcnow()
         )
 
         db.session.add(new_comment)
+        record_engagement(beat_id, COMMENT_WEIGHT, new_comment.created_at)
         db.session.commit()
 
         # Return the created comment
@@ -284,6 +541,7 @@ def delete_comment(comment_id):
             return jsonify({'error': 'Unauthorized'}), 403
 
         # Delete comment
+        record_engagement(comment.beat_id, -COMMENT_WEIGHT, comment.created_at)
         db.session.delete(comment)
         db.session.commit()
 
@@ -301,11 +559,13 @@ def toggle_like(beat_id):
     existing_like = Like.query.filter_by(user_id=user_id, beat_id=beat_id).first()
     
     if existing_like:
+        record_engagement(beat_id, -LIKE_WEIGHT, existing_like.created_at)
         db.session.delete(existing_like)
         db.session.commit()
         return jsonify({"message": "Like removed"}), 200
     
-    like = Like(user_id=user_id, beat_id=beat_id)
+    like = Like(user_id=user_id, beat_id=beat_id, created_at=datetime.utcnow())
     db.session.add(like)
+    record_engagement(beat_id, LIKE_WEIGHT, like.created_at)
     db.session.commit()
     return jsonify({"message": "Beat liked"}), 201
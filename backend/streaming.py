@@ -0,0 +1,116 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pydub.utils import get_encoder_name
+from firestore import upload_file
+
+# Segment length in seconds. Short segments let playback start as soon as the
+# first one arrives and let the player seek without fetching the whole file.
+SEGMENT_SECONDS = 4
+
+# (name, bitrate, bandwidth in bits/s advertised in the master playlist)
+RENDITIONS = [
+    ('low', '48k', 48000),
+    ('mid', '96k', 96000),
+    ('high', '160k', 160000),
+]
+
+MASTER_PLAYLIST = 'master.m3u8'
+VARIANT_PLAYLIST = 'index.m3u8'
+
+# Segments never change once written, playlists are VOD and keyed by beat id,
+# so both can be cached for a long time by browsers and CDNs.
+SEGMENT_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PLAYLIST_CACHE_CONTROL = 'public, max-age=86400'
+
+# Segments are uploaded this many at a time
+UPLOAD_THREADS = 8
+
+CONTENT_TYPES = {
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+}
+
+def hls_prefix(filename):
+    """Storage prefix holding every HLS file of a beat.
+
+    Keyed on the beat's timestamped upload filename rather than its id: ids are
+    reused after the database is reset, and the segments are cached as immutable.
+    """
+    return f"hls/{os.path.splitext(filename)[0]}"
+
+def cache_control_for(filename):
+    """Cache-Control header value for an HLS file name"""
+    if filename.endswith('.ts'):
+        return SEGMENT_CACHE_CONTROL
+    if filename.endswith('.m3u8'):
+        return PLAYLIST_CACHE_CONTROL
+    return None
+
+def _write_rendition(local_path, output_dir, bitrate):
+    """Encode one bitrate into SEGMENT_SECONDS long AAC segments plus a playlist.
+
+    ffmpeg reads the source file itself, so the recording is never decoded
+    into this process' memory.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    subprocess.run([
+        get_encoder_name(), '-nostdin', '-loglevel', 'error', '-y',
+        '-i', local_path,
+        '-vn', '-c:a', 'aac', '-b:a', bitrate,
+        '-f', 'hls',
+        '-hls_time', str(SEGMENT_SECONDS),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(output_dir, 'segment_%03d.ts'),
+        os.path.join(output_dir, VARIANT_PLAYLIST)
+    ], check=True, capture_output=True)
+
+def _write_master_playlist(output_dir):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for name, _, bandwidth in RENDITIONS:
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="mp4a.40.2"')
+        lines.append(f"{name}/{VARIANT_PLAYLIST}")
+    with open(os.path.join(output_dir, MASTER_PLAYLIST), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def _upload_directory(output_dir, prefix):
+    """Upload every packaged file, returning the public URL of the master playlist"""
+    def upload(local_path):
+        relative_path = os.path.relpath(local_path, output_dir).replace(os.sep, '/')
+        filename = os.path.basename(local_path)
+        return relative_path, upload_file(
+            local_path,
+            f"{prefix}/{relative_path}",
+            content_type=CONTENT_TYPES.get(os.path.splitext(filename)[1]),
+            cache_control=cache_control_for(filename)
+        )
+
+    master_path = os.path.join(output_dir, MASTER_PLAYLIST)
+    paths = [os.path.join(root, filename) for root, _, files in os.walk(output_dir) for filename in files]
+    with ThreadPoolExecutor(max_workers=UPLOAD_THREADS) as uploads:
+        results = dict(uploads.map(upload, [path for path in paths if path != master_path]))
+    if not all(results.values()):
+        return None
+    # The master playlist goes last so players never see it before its segments
+    return upload(master_path)[1]
+
+def package_beat(local_path, filename, upload_folder):
+    """Split a beat into HLS segments at every rendition bitrate.
+
+    The files are built under the uploads folder and uploaded to storage next to
+    the original audio. Returns the master playlist URL, or None if packaging or
+    the upload failed, in which case the beat is only played from its audio_url.
+    """
+    prefix = hls_prefix(filename)
+    output_dir = os.path.join(upload_folder, prefix)
+    try:
+        for name, bitrate, _ in RENDITIONS:
+            _write_rendition(local_path, os.path.join(output_dir, name), bitrate)
+        _write_master_playlist(output_dir)
+        return _upload_directory(output_dir, prefix)
+    except Exception as e:
+        print(f"Error packaging {filename} for streaming: {e}")
+        return None
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
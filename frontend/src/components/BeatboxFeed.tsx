@@ -36,7 +36,7 @@ const BeatboxFeed: React.FC = () => {
         return newBeats;
       });
       
-      setHasMore(pageNum < response.pages);
+      setHasMore(response.has_more);
       setPage(pageNum);
 
       // Update comments map with the comments from the response
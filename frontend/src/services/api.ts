@@ -71,9 +71,9 @@ export const auth = {
 };
 
 export const beats = {
-  getAll: async (page = 1, perPage = 10): Promise<PaginatedBeatsResponse> => {
+  getAll: async (page = 1, perPage = 10, sort: 'recent' | 'trending' = 'recent'): Promise<PaginatedBeatsResponse> => {
     try {
-      const response = await api.get(`/beats?page=${page}&per_page=${perPage}`);
+      const response = await api.get(`/beats?page=${page}&per_page=${perPage}&sort=${sort}`);
       return response.data;
     } catch (error) {
       console.error('API error getting all beats:', error);
@@ -3,6 +3,10 @@ export interface Beat {
   title: string;
   description: string;
   audio_url: string;
+  manifest_url?: string | null;
+  duration?: number | null;
+  bpm?: number | null;
+  energy?: number | null;
   author: string;
   created_at: string;
   likes_count: number;
@@ -30,7 +34,6 @@ export interface Comment {
 
 export interface PaginatedBeatsResponse {
   beats: Beat[];
-  total: number;
-  pages: number;
+  has_more: boolean;
   current_page: number;
 }